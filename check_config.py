@@ -8,6 +8,7 @@ import sys
 import re
 import xml.etree.ElementTree as ET
 from itertools import dropwhile
+from functools import wraps
 
 
 # urls of the required tools and data
@@ -20,6 +21,24 @@ yasmet_url = "https://wiki.apertium.org/wiki/Using_weights_for_ambiguous_rules"
 irstlm_url = "https://wiki.apertium.org/wiki/IRSTLM"
 
 
+def cache_found(lookup):
+    """Remember the results of 'lookup' per arguments, except when it fails and
+    returns None, so that e.g. a modes.xml that appears later is still found.
+    Callers share the returned objects and must not modify them.
+    """
+    found = {}
+
+    @wraps(lookup)
+    def cached_lookup(*args):
+        if args not in found:
+            result = lookup(*args)
+            if result is None:
+                return None
+            found[args] = result
+        return found[args]
+    return cached_lookup
+
+
 def irstlm_path():
     """Fallback to default Debian installation path if not in environ"""
     if 'IRSTLM' in os.environ:
@@ -28,6 +47,7 @@ def irstlm_path():
         return '/usr/lib/irstlm'
 
 
+@cache_found
 def get_modes(lang_data):
     modesfile = os.path.join(lang_data, 'modes.xml')
     if not os.path.isfile(modesfile):
@@ -36,6 +56,7 @@ def get_modes(lang_data):
     return ET.parse(modesfile)
 
 
+@cache_found
 def get_autobil(modes, lang_data, pair):
     found = [n for x in modes.findall(f'.//mode[@name="{pair}"]//file')
              for n in [x.attrib['name']]
@@ -58,6 +79,7 @@ def get_transferfiles(modes, lang_data, pair):
               + f"provide a valid directory or to install, follow {langs_url}")
 
 
+@cache_found
 def get_mode_after_biltrans(modes, lang_data, pair):
     """Chop the pipeline on biltrans/lexsel, return what's after those steps.
 The return value is a list of pairs of lists, one for the cmd + opts,
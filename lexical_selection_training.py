@@ -5,13 +5,32 @@ import os
 import sys
 import gzip
 import shutil
+import hashlib
+import atexit
+import tempfile
 
-from subprocess import Popen, PIPE, call
+from subprocess import Popen, PIPE, CalledProcessError, check_call
 from check_config import check_config, irstlm_path, get_modes, get_autobil, get_mode_after_biltrans
 from clean_corpus import clean_corpus
 from importlib import import_module
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import redirect_stdout, redirect_stderr
+from itertools import islice
 from typing import List
+from functools import lru_cache
+
+# small text filters, cheap enough to start that avoiding fork() matters;
+# pipe() spawns these with posix_spawn()
+SPAWN_HELPERS = {'awk', 'head', 'paste', 'sed'}
+
+# appending lex scripts' paths to environment path
+sys.path.insert(0, '/opt/local/share/apertium-lex-tools')
+sys.path.insert(0, '/usr/local/share/apertium-lex-tools')
+sys.path.insert(0, '/usr/share/apertium-lex-tools')  # Prefer /usr over /usr/local and /opt
+
+# remove after testing
+sys.path.insert(0, '../lex-tools/scripts')
 
 
 def query(question, default="yes"):
@@ -58,8 +77,13 @@ def pipe(cmds, firstin, lastout, stderr, expected_lines=None):
     hello
     hello
     """
-    if cmds == []:
-        return
+    procs = start_pipe(cmds, firstin, lastout, stderr, expected_lines)
+    if procs:
+        return procs[-1]
+
+
+def start_pipe(cmds, firstin, lastout, stderr, expected_lines=None):
+    """Like pipe(), but returns all the started processes, first to last."""
     lasterr = stderr
     if expected_lines and shutil.which("pv"):
         cmds += [['pv', '-l', '-s', str(expected_lines)]]
@@ -70,8 +94,189 @@ def pipe(cmds, firstin, lastout, stderr, expected_lines=None):
         inp = procs[i-1].stdout if i > 0 else firstin
         outp = PIPE if i+1 < len(cmds) else lastout
         errp = stderr if i+1 < len(cmds) else lasterr
-        procs.append(Popen(cmd, stdin=inp, stdout=outp, stderr=errp))
-    return procs[-1]
+        executable = shutil.which(cmd[0]) if cmd[0] in SPAWN_HELPERS else None
+        if executable:
+            # subprocess only uses posix_spawn() given a full path and
+            # close_fds=False, which is safe as our own fds aren't inheritable
+            procs.append(Popen(cmd, executable=executable, close_fds=False,
+                               stdin=inp, stdout=outp, stderr=errp))
+        else:
+            procs.append(Popen(cmd, stdin=inp, stdout=outp, stderr=errp))
+        if i > 0:
+            # the child holds its own copy of the pipe now; closing ours keeps it
+            # out of the later children and lets the writer get SIGPIPE if the
+            # reader exits early
+            procs[i-1].stdout.close()
+    return procs
+
+
+def run_pipe(cmds, firstin, lastout, stderr, expected_lines=None):
+    """Run the pipe 'cmds' (see pipe()) to the end and raise CalledProcessError
+    if any of its commands failed, not just the last one, so that a truncated
+    output is never taken for a finished one.
+    """
+    procs = start_pipe(cmds, firstin, lastout, stderr, expected_lines)
+    for proc in procs:
+        proc.wait()
+    for proc in procs:
+        if proc.returncode != 0:
+            raise CalledProcessError(proc.returncode, proc.args)
+
+
+def count_lines(path, limit=None):
+    """Count the lines of the file 'path' without reading it into memory.
+    If 'limit' is given, stop counting once that many lines have been seen.
+    """
+    count = 0
+    if limit is not None and limit <= 0:
+        return count
+    with open(path, 'rb') as f:
+        for count, _ in enumerate(f, 1):
+            if count == limit:
+                break
+    return count
+
+
+def input_key(*inputs):
+    """Return a digest identifying 'inputs' for up_to_date().
+    Files count by their contents and directories by the modification time of
+    their newest file, so that e.g. recompiling a language pair changes the key.
+    A (file, n) pair counts by the first n lines of the file, for inputs of
+    which only the start is used. Anything else counts by its string value.
+    """
+    digest = hashlib.blake2b()
+    for inp in inputs:
+        digest.update(str(inp).encode() + b'\0')
+        if isinstance(inp, tuple):
+            path, lines = inp
+            with open(path, 'rb') as f:
+                for line in islice(f, max(lines, 0)):
+                    digest.update(line)
+            continue
+        if not isinstance(inp, str):
+            continue
+        if os.path.isfile(inp):
+            with open(inp, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        elif os.path.isdir(inp):
+            mtimes = [e.stat().st_mtime_ns for e in os.scandir(inp) if e.is_file()]
+            digest.update(str(max(mtimes, default=0)).encode())
+    return digest.hexdigest()
+
+
+def up_to_date(outputs, key):
+    """Check whether all the files in 'outputs' exist and were made from the
+    inputs identified by 'key'. If not, the outputs are about to be remade, so
+    their old records are dropped in case that gets interrupted.
+    """
+    def made_from_key(output):
+        if not os.path.isfile(output) or not os.path.isfile(output + '.key'):
+            return False
+        with open(output + '.key', 'r') as f:
+            return f.read() == key
+    if all(made_from_key(output) for output in outputs):
+        return True
+    for output in outputs:
+        if os.path.isfile(output + '.key'):
+            os.remove(output + '.key')
+    return False
+
+
+def mark_up_to_date(outputs, key):
+    """Record that the files in 'outputs' were made from the inputs identified
+    by 'key'.
+    """
+    for output in outputs:
+        with open(output + '.key', 'w') as f:
+            f.write(key)
+
+
+def scratch_paths(cache_dir, expected_sizes):
+    """Return the paths of new transient files, one for each name in the dict
+    'expected_sizes', which maps names to the most bytes each file is expected
+    to hold. The files may be written at the same time, so they all go in the
+    /dev/shm tmpfs if that has room for twice their total size, which leaves
+    room for a bad estimate and for everything else using it, and all go in
+    'cache_dir' otherwise. The files are removed at exit if still around.
+    """
+    scratch_dir = cache_dir
+    if os.path.isdir('/dev/shm') and shutil.disk_usage('/dev/shm').free > 2 * sum(expected_sizes.values()):
+        scratch_dir = '/dev/shm'
+    paths = []
+    for name in expected_sizes:
+        fd, path = tempfile.mkstemp(prefix=f"{os.path.basename(cache_dir)}.{name}.", dir=scratch_dir)
+        os.close(fd)
+        paths.append(path)
+
+    def remove():
+        for path in paths:
+            if os.path.isfile(path):
+                os.remove(path)
+    atexit.register(remove)
+    return paths
+
+
+def cached_call(cmds, stdin_path, stdout_path, log):
+    """Run the pipe 'cmds' (see pipe()) from the file 'stdin_path' into the
+    file 'stdout_path', unless an earlier run with the same commands and input
+    already made it. Raises CalledProcessError, leaving the output unmarked,
+    if any of the commands fail.
+    """
+    key = input_key(stdin_path, *(arg for cmd in cmds for arg in cmd))
+    if up_to_date([stdout_path], key):
+        return
+    with open(stdin_path, 'r') as inp, open(stdout_path, 'w') as outp:
+        run_pipe(cmds, inp, outp, log)
+    mark_up_to_date([stdout_path], key)
+
+
+def report(message):
+    """Print 'message' and its newline in a single write, so that the messages
+    of tasks running side by side (see run_graph()) don't interleave.
+    """
+    print(message + '\n', end='', flush=True)
+
+
+def run_graph(tasks):
+    """Run 'tasks', a dict mapping names to (function, names of the tasks it
+    depends on) pairs, starting each function in its own thread as soon as the
+    tasks it depends on are done. Tasks must come after their dependencies.
+    Waiting on a subprocess doesn't hold the GIL, so independent pipelines
+    really do run side by side.
+    """
+    def run_after(dependencies, function):
+        for dependency in dependencies:
+            dependency.result()
+        return function()
+
+    futures = {}
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        for name, (function, dependencies) in tasks.items():
+            futures[name] = executor.submit(run_after, [futures[d] for d in dependencies], function)
+    for future in futures.values():
+        future.result()
+
+
+@lru_cache(maxsize=None)
+def lex_tool(module, function):
+    """Look up 'function' in the apertium-lex-tools script 'module', importing
+    it on first use. Forked workers inherit whatever was looked up before the
+    fork.
+    """
+    return getattr(import_module(module), function)
+
+
+def run_script(module, function, args, output, log):
+    """Call 'function' from the apertium-lex-tools script 'module' with
+    'args', writing what it prints to the file 'output' and its errors to the
+    file descriptor 'log'. Only takes picklable arguments, so that it can also
+    run in a worker process.
+    """
+    func = lex_tool(module, function)
+    with open(output, 'w') as f, open(log, 'w', closefd=False) as err, \
+            redirect_stdout(f), redirect_stderr(err):
+        func(*args)
 
 
 def parallel_training(config, cache_dir, log):
@@ -84,8 +289,6 @@ def parallel_training(config, cache_dir, log):
     tl_tagged = os.path.join(
         cache_dir, f"{config['CORPUS']}.tagged.{config['TL']}")
     lines = os.path.join(cache_dir, f"{config['CORPUS']}.lines")
-    tagged_merged = os.path.join(
-        cache_dir, f"{config['CORPUS']}.tagged-merged.{config['SL']}-{config['TL']}")
     alignment = os.path.join(
         cache_dir, f"{config['CORPUS']}.align.{config['SL']}-{config['TL']}")
     clean_biltrans = os.path.join(
@@ -108,6 +311,10 @@ def parallel_training(config, cache_dir, log):
     #     cache_dir, 'rules_all.txt')
     # ngrams_all = os.path.join(
     #     cache_dir, 'ngrams_all.txt')
+    # tmp_sl = os.path.join(
+    #     cache_dir, 'tmp.sl')
+    # tmp_yasmet = os.path.join(
+    #     cache_dir, 'tmp.yasmet')
     rules = f"{config['CORPUS']}.{config['SL']}-{config['TL']}.ngrams-lm-{MIN}.lrx"
 
     if os.path.isfile(rules):
@@ -116,142 +323,127 @@ def parallel_training(config, cache_dir, log):
             exit(1)
         os.remove(rules)
 
-    with open(config['CORPUS_SL'], 'r') as corpus_sl:
-        training_lines = len(corpus_sl.readlines())
-        if config['TRAINING_LINES'] > training_lines:
-            print(
-                f"Warning: {config['TRAINING_LINES']}(TRAINING_LINES) > {training_lines}")
-        else:
-            training_lines = config['TRAINING_LINES']
+    training_lines = count_lines(config['CORPUS_SL'], config['TRAINING_LINES'])
+    if config['TRAINING_LINES'] > training_lines:
+        print(
+            f"Warning: {config['TRAINING_LINES']}(TRAINING_LINES) > {training_lines}")
 
     print(f"Using {training_lines} lines from the corpora")
 
-    print("Tagging the source side corpus ...")
-    cmds = [['head', '-n', str(training_lines)],
-            ['tr', '\\/$^@', '?'],  # clean corpus
-            ['apertium', '-d', config['LANG_DATA'],
-             f"{config['SL']}-{config['TL']}-tagger"],
-            ['apertium-pretransfer']]
-    with open(config['CORPUS_SL']) as inp, open(sl_tagged, 'w') as outp:
-        pipe(cmds, inp, outp, log, training_lines).wait()
-
-    print("Tagging the target side corpus ...")
-    cmds = [['head', '-n', str(training_lines)],
-            ['tr', '\\/$^@', '?'],  # clean corpus
-            ['apertium', '-d', config['LANG_DATA'],
-             f"{config['TL']}-{config['SL']}-tagger"],
-            ['apertium-pretransfer']]
-    with open(config['CORPUS_TL']) as inp, open(tl_tagged, 'w') as outp:
-        pipe(cmds, inp, outp, log, training_lines).wait()
-
-    print("Combining tagged corpora ...")
-    # removing lines with no analyses
-    with open(lines, 'w') as f:
-        call(['seq', '1', str(training_lines)],
-             stdout=f, stderr=log)
-
-    clean_tagged = os.path.join(
-        cache_dir, f"{config['CORPUS']}.clean_tagged")
-    with open(clean_tagged, 'w') as f1:
-        cmds = [['paste', lines, sl_tagged, tl_tagged],
-                ['grep', '<*\t*<']]
-        pipe(cmds, None, f1, log).wait()
-
-    with open(clean_tagged, 'r') as f0:
-        with open(lines, 'w') as f1:
-            call(['cut', '-f', '1'], stdin=f0, stdout=f1, stderr=log)
-
-        f0.seek(0)
-        with open(sl_tagged, 'w') as f2:
-            cmds = [['cut', '-f', '2'],
-                    ['sed', 's/ /~~/g'],
-                    ['sed', r's/\$[^\^]*/$ /g']]
-            pipe(cmds, f0, f2, log).wait()
-
-        f0.seek(0)
-        with open(tl_tagged, 'w') as f2:
-            cmds = [['cut', '-f', '3'],
-                    ['sed', 's/ /~~/g'],
-                    ['sed', r's/\$[^\^]*/$ /g']]
-            pipe(cmds, f0, f2, log).wait()
-
-    os.remove(clean_tagged)
-
-    with open(tagged_merged, 'w') as f:
-        with open(os.devnull, 'r') as f1:
-            call(['paste', '-d', '||| ', tl_tagged, '-', '-', '-',
-                  sl_tagged], stdin=f1, stdout=f, stderr=log)
-
-    print("Aligning parallel corpus ...")
-    with open(alignment, 'w') as f:
-        call([config['FAST_ALIGN'], '-i', tagged_merged, '-d', '-o', '-v'],
-             stdout=f,
-             stderr=log)
-
-    with open(sl_tagged, 'r+') as f:
-        data = f.read()
-        f.seek(0)
-        f.write(data.replace('~~', ' '))
-
-    with open(tl_tagged, 'r+') as f:
-        data = f.read()
-        f.seek(0)
-        f.write(data.replace('~~', ' '))
-
-    # temp files
-    tmp1 = 'tmp1'
-    tmp2 = 'tmp2'
-
-    print("Processing tagger output and creating phrase table ...")
     modes = get_modes(config['LANG_DATA'])
-    with open(tmp1, 'w') as f1, open(tmp2, 'w') as f2:
-        sl_tl_autobil = get_autobil(modes, config['LANG_DATA'], config['PAIR'])
-        tl_sl_autobil = get_autobil(modes, config['LANG_DATA'], config['REVERSE_PAIR'])
-        with open(tl_tagged, 'r') as f:
-            # call([os.path.join(config['LEX_TOOLS'], 'process-tagger-output'),
-            call(['process-tagger-output', tl_sl_autobil],
-                 stdin=f, stdout=f1, stderr=log)
-        with open(sl_tagged, 'r') as f:
-            # call([os.path.join(config['LEX_TOOLS'], 'process-tagger-output'),
-            call(['process-tagger-output', sl_tl_autobil],
-                 stdin=f, stdout=f2, stderr=log)
-            f.seek(0)
-            with open(clean_biltrans, 'w') as f0:
-                # call([os.path.join(config['LEX_TOOLS'], 'process-tagger-output'),
-                call(['process-tagger-output', sl_tl_autobil],
-                     stdin=f, stdout=f0, stderr=log)
-
-    cmds = [['paste', tmp1, tmp2, alignment], ['sed', 's/\t/ ||| /g']]
-    with open(phrasetable, 'w') as f:
-        pipe(cmds, None, f, log).wait()
-
-    os.remove(tmp1)
-    os.remove(tmp2)
+    sl_tl_autobil = get_autobil(modes, config['LANG_DATA'], config['PAIR'])
+    tl_sl_autobil = get_autobil(modes, config['LANG_DATA'], config['REVERSE_PAIR'])
+
+    # tagging, aligning and building the phrase table are the slowest steps, so
+    # their results are reused for as long as the corpora, language pair and
+    # settings stay the same
+    cached = [sl_tagged, tl_tagged, lines, alignment, clean_biltrans, phrasetable]
+    # only the lines used for training are read, so only they go in the key
+    key = input_key((config['CORPUS_SL'], training_lines), (config['CORPUS_TL'], training_lines),
+                    config['LANG_DATA'], config['FAST_ALIGN'], training_lines, sl_tl_autobil, tl_sl_autobil)
+    if up_to_date(cached, key):
+        print("Reusing the tagged and aligned corpora and the phrase table ...")
+    else:
+        # take the first training_lines lines and clean the corpus in one go
+        clean_cmd = ['awk', rf'NR > {training_lines} {{ exit }} {{ gsub(/[\\\/$^@]/, "?"); print }}']
+
+        def tag(side, corpus, mode, tagged, expected_lines=None):
+            report(f"Tagging the {side} side corpus ...")
+            cmds = [clean_cmd,
+                    ['apertium', '-d', config['LANG_DATA'], mode],
+                    ['apertium-pretransfer']]
+            with open(corpus) as inp, open(tagged, 'w') as outp:
+                run_pipe(cmds, inp, outp, log, expected_lines)
+
+        def combine():
+            report("Combining tagged corpora ...")
+            # removing lines with no analyses in a single pass, keeping the numbers of
+            # the remaining ones and, on both sides, replacing ' ' by '~~' and the
+            # blanks between words by a single ' '; the outputs are created up front
+            # as awk only makes them on the first print, and no line may pass
+            cmds = [['paste', sl_tagged, tl_tagged],
+                    ['awk', '-F', '\t', '-v', f'lines={lines}',
+                     '-v', f'sl={sl_tagged}.tmp', '-v', f'tl={tl_tagged}.tmp',
+                     r'BEGIN { printf "" > lines; printf "" > sl; printf "" > tl }'
+                     r' /</ { for (i = 1; i <= 2; i++) { gsub(/ /, "~~", $i); gsub(/\$[^\\^]*/, "$ ", $i) }'
+                     r' print NR > lines; print $1 > sl; print $2 > tl }']]
+            run_pipe(cmds, None, None, log)
+            os.replace(sl_tagged + '.tmp', sl_tagged)
+            os.replace(tl_tagged + '.tmp', tl_tagged)
+
+        # the progress bar follows the source side
+        run_graph({
+            'tag_sl': (lambda: tag('source', config['CORPUS_SL'], f"{config['SL']}-{config['TL']}-tagger",
+                                   sl_tagged, training_lines), []),
+            'tag_tl': (lambda: tag('target', config['CORPUS_TL'], f"{config['TL']}-{config['SL']}-tagger",
+                                   tl_tagged), []),
+            'combine': (combine, ['tag_sl', 'tag_tl']),
+        })
+
+        # temp files
+        # the merged file is both tagged sides plus a separator per line, so
+        # twice their total size is ample; process-tagger-output repeats each
+        # analysis followed by its translations, which for the usual one or two
+        # translations per word makes it two to three times its input
+        tagged_merged, tmp1 = scratch_paths(cache_dir, {
+            'tagged-merged': 2 * (os.path.getsize(sl_tagged) + os.path.getsize(tl_tagged)),
+            'tmp1': 4 * os.path.getsize(tl_tagged),
+        })
+
+        def align():
+            report("Aligning parallel corpus ...")
+            # fast_align's input format, 'target ||| source' per line (the tagged
+            # lines already end in a blank)
+            with open(tagged_merged, 'w') as f:
+                check_call(['awk', '-v', f'tl={tl_tagged}', '-v', f'sl={sl_tagged}',
+                            'BEGIN { while ((getline t < tl) > 0 && (getline s < sl) > 0) print t "||| " s }'],
+                           stdout=f, stderr=log)
+
+            # fast_align reads its input once per iteration, so it can't come from
+            # a pipe; the merged file is only needed until the alignment is done
+            with open(alignment, 'w') as f:
+                check_call([config['FAST_ALIGN'], '-i', tagged_merged, '-d', '-o', '-v'],
+                           stdout=f,
+                           stderr=log)
+            os.remove(tagged_merged)
+
+        def process_tagger_output(tagged, autobil, output):
+            # the tagged files keep their '~~' for fast_align, which is running at
+            # the same time; they are turned back into blanks on the way in
+            cmds = [['sed', 's/~~/ /g'],
+                    # [os.path.join(config['LEX_TOOLS'], 'process-tagger-output'),
+                    ['process-tagger-output', autobil]]
+            with open(tagged, 'r') as inp, open(output, 'w') as outp:
+                run_pipe(cmds, inp, outp, log)
+
+        def make_phrasetable():
+            cmds = [['paste', tmp1, clean_biltrans, alignment], ['sed', 's/\t/ ||| /g']]
+            with open(phrasetable, 'w') as f:
+                run_pipe(cmds, None, f, log)
+
+            os.remove(tmp1)
+
+        print("Processing tagger output and creating phrase table ...")
+        # the source side output is both a phrase table column and clean_biltrans,
+        # so it is only computed once
+        run_graph({
+            'align': (align, []),
+            'tl_biltrans': (lambda: process_tagger_output(tl_tagged, tl_sl_autobil, tmp1), []),
+            'sl_biltrans': (lambda: process_tagger_output(sl_tagged, sl_tl_autobil, clean_biltrans), []),
+            'phrasetable': (make_phrasetable, ['align', 'tl_biltrans', 'sl_biltrans']),
+        })
+        mark_up_to_date(cached, key)
 
     print("Turning aligned ngrams into rules ...")
-    # extract sentences
-    mod = import_module('extract-sentences')
-    extract_sentences = getattr(mod, 'extract_sentences')
-    with open(candidates, 'w') as f, redirect_stdout(f), redirect_stderr(log):
-        extract_sentences(phrasetable, clean_biltrans)
-
-    # extract freq lexicon
-    mod = import_module('extract-freq-lexicon')
-    extract_freq_lexicon = getattr(mod, 'extract_freq_lexicon')
-    with open(freq_lex, 'w') as f, redirect_stdout(f), redirect_stderr(log):
-        extract_freq_lexicon(candidates)
-
-    # count patterns
-    mod = import_module('ngram-count-patterns')
-    ngram_count_patterns = getattr(mod, 'ngram_count_patterns')
-    with open(ngrams, 'w') as f, redirect_stdout(f), redirect_stderr(log):
-        ngram_count_patterns(freq_lex, candidates, config['CRISPHOLD'], config['MAX_RULES'])
-
-    # ngrams to rules
-    mod = import_module('ngrams-to-rules')
-    ngrams_to_rules = getattr(mod, 'ngrams_to_rules')
-    with open(rules, 'w') as f, redirect_stdout(f), redirect_stderr(log):
-        ngrams_to_rules(ngrams, config['CRISPHOLD'])
+    # these steps each need the output of the one before, so they run in turn
+    run_script('extract-sentences', 'extract_sentences',
+               (phrasetable, clean_biltrans), candidates, log)
+    run_script('extract-freq-lexicon', 'extract_freq_lexicon',
+               (candidates,), freq_lex, log)
+    run_script('ngram-count-patterns', 'ngram_count_patterns',
+               (freq_lex, candidates, config['CRISPHOLD'], config['MAX_RULES']), ngrams, log)
+    run_script('ngrams-to-rules', 'ngrams_to_rules',
+               (ngrams, config['CRISPHOLD']), rules, log)
     return rules
 
     # # count patterns
@@ -269,13 +461,13 @@ def parallel_training(config, cache_dir, log):
     # with open(events_trimmed, 'r') as f:
     #     cmds = [['cut', '-f', '1'], ['sort', '-u']]  # ,
     #     # ['sed', 's/[\*\^\$]/\\\\\1/g']]
-    #     with open('tmp.sl', 'w') as f0:
+    #     with open(tmp_sl, 'w') as f0:
     #         pipe(cmds, f, f0, log).wait()
 
     # # extracting lambdas with yasmet
-    # with open('tmp.sl', 'r') as f:
+    # with open(tmp_sl, 'r') as f:
     #     temp_lambdas = f.read()
-    #     with open(events_trimmed, 'r') as f0, open('tmp.yasmet', 'a+') as f1, open(lambdas, 'a') as f2:
+    #     with open(events_trimmed, 'r') as f0, open(tmp_yasmet, 'a+') as f1, open(lambdas, 'a') as f2:
     #         f2.truncate(0)
     #         for l in temp_lambdas.split('\n')[:-1]:
     #             f0.seek(0)
@@ -293,8 +485,8 @@ def parallel_training(config, cache_dir, log):
     #                 ['yasmet', '-red', str(MIN)], ['yasmet'], ['sed', 's/ /\t/g'], ['sed', f's/^/{l}\t/g']]
     #             pipe(cmds, f1, f2, log).wait()
 
-    # os.remove('tmp.yasmet')
-    # os.remove('tmp.sl')
+    # os.remove(tmp_yasmet)
+    # os.remove(tmp_sl)
 
     # # merge ngrams lambdas
     # mod = import_module('merge-ngrams-lambdas')
@@ -347,110 +539,93 @@ def non_parallel_training(config, cache_dir, log):
                 exit(1)
             os.remove(tl_lm)
 
-    with open(config['CORPUS_SL'], 'r') as corpus_sl:
-        training_lines = len(corpus_sl.readlines())
-        if config['TRAINING_LINES'] > training_lines:
-            print(
-                f"Warning: {config['TRAINING_LINES']}(TRAINING_LINES) > {training_lines}")
-        else:
-            training_lines = config['TRAINING_LINES']
-
-    print(f"Tagging {training_lines} lines from the source side corpus ...")
-    cmds = [['head', '-n', str(training_lines)],
-            ['apertium', '-d', config['LANG_DATA'],
-             f"{config['SL']}-{config['TL']}-tagger"],
-            ['apertium-pretransfer']]
-    with open(config['CORPUS_SL']) as inp, open(sl_tagged, 'w') as outp:
-        pipe(cmds, inp, outp, log, training_lines).wait()
-
-    # removing lines with no analyses
-    with open(lines, 'w') as f:
-        call(['seq', '0', str(training_lines-1)],
-             stdout=f, stderr=log)
-
-    clean_tagged = os.path.join(
-        cache_dir, f"{config['CORPUS']}.clean_tagged")
-    with open(clean_tagged, 'w') as f1:
-        cmds = [['paste', lines, sl_tagged],
-                ['grep', '<*\t*<']]
-        pipe(cmds, None, f1, log).wait()
-
-    with open(clean_tagged, 'r') as f0:
-        with open(lines, 'w') as f1:
-            call(['cut', '-f', '1'], stdin=f0, stdout=f1, stderr=log)
-
-        f0.seek(0)
-        with open(sl_tagged, 'w') as f2:
-            # cmds = [['cut', '-f', '2'], ['sed', 's/ /~~/g'],
-            #         ['sed', 's/\$[^\^]*/$ /g']]
-            # pipe(cmds, f0, f2, log).wait()
-            call(['cut', '-f', '2'], stdin=f0, stdout=f2, stderr=log)
-
-    os.remove(clean_tagged)
+    training_lines = count_lines(config['CORPUS_SL'], config['TRAINING_LINES'])
+    if config['TRAINING_LINES'] > training_lines:
+        print(
+            f"Warning: {config['TRAINING_LINES']}(TRAINING_LINES) > {training_lines}")
 
-    if 'TL_MODEL' in config:
-        tl_lm = config['TL_MODEL']
-    else:
-        print("Making a language model from all lines of " + config['CORPUS_TL']
-              + " using IRSTLM from " + irstlm_path()
-              + " and temporary files in ./tmp/")
-        os.environ['IRSTLM'] = irstlm_path()
-        call([os.path.join(irstlm_path(), 'bin/build-lm.sh'), '-i', config['CORPUS_TL'], '-o',
-              tl_lm+'.gz', '-t', 'tmp'], stderr=log)
+    modes = get_modes(config['LANG_DATA'])
+    sl_tl_autobil = get_autobil(modes, config['LANG_DATA'], config['PAIR'])
+    mode_after_biltrans = get_mode_after_biltrans(modes, config['LANG_DATA'], config['PAIR'])
+
+    def tag():
+        report(f"Tagging {training_lines} lines from the source side corpus ...")
+        cmds = [['head', '-n', str(training_lines)],
+                ['apertium', '-d', config['LANG_DATA'],
+                 f"{config['SL']}-{config['TL']}-tagger"],
+                ['apertium-pretransfer']]
+        with open(config['CORPUS_SL']) as inp, open(sl_tagged, 'w') as outp:
+            run_pipe(cmds, inp, outp, log, training_lines)
+
+        # removing lines with no analyses, keeping the (0-based) numbers of the
+        # remaining ones (both created up front, in case none are left)
+        with open(sl_tagged, 'r') as f:
+            check_call(['awk', '-v', f'lines={lines}', '-v', f'sl={sl_tagged}.tmp',
+                        'BEGIN { printf "" > lines; printf "" > sl } /</ { print NR - 1 > lines; print > sl }'],
+                       stdin=f, stderr=log)
+        os.replace(sl_tagged + '.tmp', sl_tagged)
+
+    def build_lm():
+        report("Making a language model from all lines of " + config['CORPUS_TL']
+               + " using IRSTLM from " + irstlm_path()
+               + " and temporary files in ./tmp/")
+        check_call([os.path.join(irstlm_path(), 'bin/build-lm.sh'), '-i', config['CORPUS_TL'], '-o',
+                    tl_lm+'.gz', '-t', 'tmp'], stderr=log)
 
         with gzip.open(tl_lm+'.gz', 'rb') as f_in, open(tl_lm, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
+            # build-lm.sh always gzips its output; copying in big chunks keeps the
+            # number of reads and writes down on large models
+            shutil.copyfileobj(f_in, f_out, 4 * 1024 * 1024)
 
         os.remove(tl_lm+'.gz')
         # os.remove('tmp_tl')
 
-    modes = get_modes(config['LANG_DATA'])
-    sl_tl_autobil = get_autobil(modes, config['LANG_DATA'], config['PAIR'])
-    mode_after_biltrans = get_mode_after_biltrans(modes, config['LANG_DATA'], config['PAIR'])
+    def multitrans(opts, output):
+        report(f"Running multitrans {' '.join(opts)} ...")
+        cached_call([['multitrans'] + opts + ['-f', sl_tl_autobil]], sl_tagged, output, log)
 
-    print("Running multitrans ...")
-    with open(sl_tagged) as f_in:
-        with open(ambig, 'w') as f_out:
-            cmds = [['multitrans', '-b', '-t', '-n', '-f', sl_tl_autobil]]
-            pipe(cmds, f_in, f_out, log)
-
-        f_in.seek(0)
-        with open(multi_trimmed, 'w') as f_out:
-            cmds = [['multitrans', '-m', '-t', '-f', sl_tl_autobil]]
-            pipe(cmds, f_in, f_out, log)
-
-    print("Running irstlm-ranker on mode after biltrans ...")
-    with open(multi_trimmed) as f_in, open(ranked, 'w') as f_out:
+    def rank():
+        report("Running irstlm-ranker on mode after biltrans ...")
+        # irstlm-ranker scores the translations coming in on stdin and reads
+        # multi_trimmed itself to pair each of them with its source line, so it
+        # has to be complete before this starts
         cmds = [p[0] + p[1] for p in mode_after_biltrans] + [['irstlm-ranker', tl_lm, multi_trimmed, '-f']]
-        pipe(cmds, f_in, f_out, log).wait()
+        cached_call(cmds, multi_trimmed, ranked, log)
+
+    # the language model only needs the target side corpus, so it gets built
+    # while the source side is tagged and run through multitrans
+    tasks = {'tag': (tag, [])}
+    if 'TL_MODEL' in config:
+        tl_lm = config['TL_MODEL']
+    else:
+        os.environ['IRSTLM'] = irstlm_path()
+        tasks['lm'] = (build_lm, [])
+    tasks['ambig'] = (lambda: multitrans(['-b', '-t', '-n'], ambig), ['tag'])
+    tasks['multi_trimmed'] = (lambda: multitrans(['-m', '-t'], multi_trimmed), ['tag'])
+    tasks['ranked'] = (rank, ['multi_trimmed'] + (['lm'] if 'lm' in tasks else []))
+    run_graph(tasks)
 
     # with open(annotated, 'w') as f_out:
     #     call(['paste', multi_trimmed, ranked], stdout=f_out, stderr=log)
 
     print("Turning ranked ngrams into rules ...")
-    # extract frac freq
-    mod = import_module('biltrans-extract-frac-freq')
-    extract_frac_freq = getattr(mod, 'biltrans_extract_frac_freq')
-    with open(lex_freq, 'w') as f, redirect_stdout(f), redirect_stderr(log):
-        extract_frac_freq(ambig, ranked)
-
-    # ngrams
-    mod = import_module('biltrans-count-patterns-ngrams')
-    count_patterns_ngrams = getattr(mod, 'biltrans_count_patterns_ngrams')
-    with open(ngrams, 'w') as f, redirect_stdout(f), redirect_stderr(log):
-        count_patterns_ngrams(ambig, ranked)
-
-    # patterns
-    mod = import_module('ngram-pruning-frac')
-    ngram_pruning_frac = getattr(mod, 'ngram_pruning_frac')
-    with open(patterns, 'w') as f, redirect_stdout(f), redirect_stderr(log):
-        ngram_pruning_frac(lex_freq, ngrams)
-
-    # extracting rules
-    mod = import_module('ngrams-to-rules')
-    ngrams_to_rules = getattr(mod, 'ngrams_to_rules')
-    with open(rules, 'w') as f, redirect_stdout(f), redirect_stderr(log):
-        ngrams_to_rules(patterns, config['CRISPHOLD'])
+    # the frac freq and ngram counts only need ambig and ranked, so they are
+    # counted side by side in separate processes, which get the scripts already
+    # imported
+    lex_tool('biltrans-extract-frac-freq', 'biltrans_extract_frac_freq')
+    lex_tool('biltrans-count-patterns-ngrams', 'biltrans_count_patterns_ngrams')
+    with ProcessPoolExecutor(max_workers=2, mp_context=get_context('fork')) as executor:
+        frac_freq = executor.submit(run_script, 'biltrans-extract-frac-freq', 'biltrans_extract_frac_freq',
+                                    (ambig, ranked), lex_freq, log)
+        count_ngrams = executor.submit(run_script, 'biltrans-count-patterns-ngrams', 'biltrans_count_patterns_ngrams',
+                                       (ambig, ranked), ngrams, log)
+        frac_freq.result()
+        count_ngrams.result()
+
+    run_script('ngram-pruning-frac', 'ngram_pruning_frac',
+               (lex_freq, ngrams), patterns, log)
+    run_script('ngrams-to-rules', 'ngrams_to_rules',
+               (patterns, config['CRISPHOLD']), rules, log)
     return rules
 
 
@@ -458,14 +633,6 @@ def main(config_file):
     print("Validating configuration ...")
     config = check_config(config_file)
 
-    # appending lex scripts' paths to environment path
-    sys.path.insert(0, '/opt/local/share/apertium-lex-tools')
-    sys.path.insert(0, '/usr/local/share/apertium-lex-tools')
-    sys.path.insert(0, '/usr/share/apertium-lex-tools')  # Prefer /usr over /usr/local and /opt
-
-    # remove after testing
-    sys.path.insert(0, '../lex-tools/scripts')
-
     # cleaning the parallel corpus i.e. removing empty sentences, sentences only with '*', '.', or '°'
     # print("Cleaning corpus ...")
     # clean_corpus(config['CORPUS_SL'], config['CORPUS_TL'])
@@ -475,21 +642,26 @@ def main(config_file):
     if not config['IS_PARALLEL']:
         cache_dir = cache_dir + '-np'
     # the directory where all the intermediary outputs are stored
-    if os.path.isdir(cache_dir):
+    if os.path.isdir(cache_dir) and not query(f"Do you want to reuse the up to date files in '{cache_dir}'"):
         if not query(f"Do you want to overwrite the files in '{cache_dir}'"):
             print(f"(re)move {cache_dir} and re-run lexical_training.py")
             exit(0)
         shutil.rmtree(cache_dir)
 
-    os.mkdir(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
 
     log = os.path.join(cache_dir, "training.log")
 
-    with open(log, 'a') as log_file:
+    # the log is shared as a raw descriptor: children write to it directly,
+    # with no Python buffer in between to reorder their output
+    log_fd = os.open(log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
         if config['IS_PARALLEL']:
-            rules = parallel_training(config, cache_dir, log_file)
+            rules = parallel_training(config, cache_dir, log_fd)
         else:
-            rules = non_parallel_training(config, cache_dir, log_file)
+            rules = non_parallel_training(config, cache_dir, log_fd)
+    finally:
+        os.close(log_fd)
     print(f"Training complete! Generated lrx file: {rules}")
 
 
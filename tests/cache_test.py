@@ -0,0 +1,95 @@
+# tests the caching helpers of lexical_selection_training.py and check_config.py
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from check_config import cache_found
+from lexical_selection_training import input_key, up_to_date, mark_up_to_date
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_matching_key_is_reused():
+    with tempfile.TemporaryDirectory() as tmp:
+        inp, out = os.path.join(tmp, 'in'), os.path.join(tmp, 'out')
+        write(inp, 'a\nb\n')
+        write(out, 'done\n')
+        key = input_key(inp, 'cmd')
+        assert not up_to_date([out], key)
+        mark_up_to_date([out], key)
+        assert up_to_date([out], input_key(inp, 'cmd'))
+
+
+def test_key_follows_file_content():
+    with tempfile.TemporaryDirectory() as tmp:
+        inp = os.path.join(tmp, 'in')
+        write(inp, 'a\nb\n')
+        key = input_key(inp)
+        write(inp, 'a\nc\n')
+        assert input_key(inp) != key
+
+
+def test_key_follows_line_range():
+    with tempfile.TemporaryDirectory() as tmp:
+        inp = os.path.join(tmp, 'in')
+        write(inp, 'a\nb\nc\n')
+        key = input_key((inp, 2))
+        assert input_key((inp, 3)) != key
+        # lines past the range don't matter, lines in it do
+        write(inp, 'a\nb\nz\n')
+        assert input_key((inp, 2)) == key
+        write(inp, 'a\nz\nc\n')
+        assert input_key((inp, 2)) != key
+
+
+def test_key_follows_newest_mtime_in_directory():
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.path.join(tmp, 'data')
+        os.mkdir(data)
+        write(os.path.join(data, 'a.bin'), 'a')
+        os.utime(os.path.join(data, 'a.bin'), ns=(10**18, 10**18))
+        key = input_key(data)
+        assert input_key(data) == key
+        os.utime(os.path.join(data, 'a.bin'), ns=(2 * 10**18, 2 * 10**18))
+        assert input_key(data) != key
+
+
+def test_mismatch_drops_key_files():
+    with tempfile.TemporaryDirectory() as tmp:
+        outs = [os.path.join(tmp, 'out1'), os.path.join(tmp, 'out2')]
+        for out in outs:
+            write(out, 'done\n')
+        mark_up_to_date(outs, 'old')
+        # one output missing its key is enough to remake all of them
+        os.remove(outs[1] + '.key')
+        assert not up_to_date(outs, 'old')
+        assert not os.path.exists(outs[0] + '.key')
+        mark_up_to_date(outs, 'old')
+        assert not up_to_date(outs, 'new')
+        assert not any(os.path.exists(out + '.key') for out in outs)
+
+
+def test_cache_found_forgets_failures():
+    results = [None, 'found']
+    calls = []
+
+    @cache_found
+    def lookup(name):
+        calls.append(name)
+        return results[len(calls) - 1]
+
+    assert lookup('x') is None
+    assert lookup('x') == 'found'
+    assert lookup('x') == 'found'
+    assert calls == ['x', 'x']
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} : OK")